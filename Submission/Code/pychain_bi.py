@@ -13,6 +13,10 @@
 # * Replace Block Inspector selectbox with Slider
 # * Present Block Inspector selected block using markdown table rather than the st.write to avoid method commentary being presented
 # * Located push buttons in close proximity.
+# * Added a Merkle Mountain Range accumulator over block hashes to locate tampered blocks and prove block inclusion
+# * Stamp each block with its own creation time rather than the time the script was loaded
+# * Added a time-range query engine over the ledger for flow analytics
+# * Added pluggable SHA-256 / BLAKE2b / SHA3 hash backends, a startup benchmark choosing another only when clearly faster than SHA-256
 
 
 
@@ -42,11 +46,10 @@
 ################################################################################
 # Imports
 import streamlit as st
-from dataclasses import dataclass
-from typing import Any, List
 import datetime as datetime
 import pandas as pd
-import hashlib
+
+from pychain_ledger import Record, Block, PyChain, MerkleMountainRange, select_hash_backend
 
 import os
 from pathlib import Path
@@ -87,106 +90,17 @@ addressbook=[
 
 address_book_df = pd.DataFrame(addressbook)
 address_book_df.reset_index()
-################################################################################
-# Step 1:
-# Create a Record Data Class
-
-# Create a Record Data Class that consists of the `sender`, `receiver`, and
-# `amount` attributes
-@dataclass
-class Record:
-    sender: str             
-    receiver: str
-    amount: float
-
-
 
 ################################################################################
-# Step 2:
-# Modify the Existing Block Data Class to Store Record Data
-
-@dataclass
-class Block:
-    """Creates a Block Chain block object\n\n
-
-    Parameters arguments:\n
-    record -- the record of data to be stored in the block\n
-    creator_id -- the ID of the Creator\n
-    prev_hash -- the has of the previous block in the chain. Default: "0"\n
-    nonce -- the nonce for the block. Default: 0
-    """
-    record: Record
-    creator_id: int
-    prev_hash: str = "0"
-    timestamp: str = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")  # Use the full ISO 8601 date and time format YYYY-MM-DDTHH:MM:SS.ssssssZ 
-    nonce: int = 0
-
-    def hash_block(self):
-        """Returns the sha hash digest in hexadecimal of the class attributes."""
-        sha = hashlib.sha256()
-
-        record = str(self.record).encode()
-        sha.update(record)
-
-        creator_id = str(self.creator_id).encode()
-        sha.update(creator_id)
-
-        timestamp = str(self.timestamp).encode()
-        sha.update(timestamp)
-
-        prev_hash = str(self.prev_hash).encode()
-        sha.update(prev_hash)
-
-        nonce = str(self.nonce).encode()
-        sha.update(nonce)
-
-        return sha.hexdigest()
-    
-# PyChain Class
-@dataclass
-class PyChain:
-    chain: List[Block]
-    difficulty: int = 4
-
-    # PyChain Proof Of Work method - returns a block with a hash meeting the difficulty target
-    def proof_of_work(self, block):
-        calculated_hash = block.hash_block()
-
-        num_of_zeros = "0" * self.difficulty
-
-        while not calculated_hash.startswith(num_of_zeros):
-
-            block.nonce += 1
-
-            calculated_hash = block.hash_block()
-
-        return block
-
-    # PyChain Add Block method - calls proof of work and then adds a block to the PyChain
-    def add_block(self, candidate_block):
-        block = self.proof_of_work(candidate_block)
-        self.chain += [block]
-
-    # PyChain Is Valid method - runs through each block in the PyChain and checks the validity of the hash. Returns false at the first invalid hash or true if all are valid
-    def is_valid(self):
-        block_hash = self.chain[0].hash_block()
-
-        for block in self.chain[1:]:
-            if block_hash != block.prev_hash:
-                print("Blockchain is invalid!")
-                return False
-
-            block_hash = block.hash_block()
-
-        print("Blockchain is Valid")
-        return True
-
+# Step 1 and Step 2:
+# The Record and Block data classes, along with the PyChain ledger itself, are in pychain_ledger.py
 
 # Helper function to initialise the PyChain 
 @st.cache_resource()
 def setup():
     print("Initializing Chain")
-    return PyChain([Block("Genesis", 0)])
+    hash_algorithm = select_hash_backend()  # Benchmark the allowed hash backends and record the fastest in the Genesis block
+    return PyChain([Block("Genesis", 0, hash_algorithm=hash_algorithm)])
 
 # Helper function to initialise cache session variables 
 @st.cache_resource()
@@ -378,7 +292,7 @@ if mid_c.button("Validate Chain", help = "Validates the blocks in the PyChain Le
     if pychain.is_valid():
         st.toast(':green[Chain validation passed]', icon="✅")
     else:
-        st.toast(':red[Chain validation failed]', icon="🚨")
+        st.toast(f':red[Chain validation failed - first tampered block: {pychain.tampered_height}]', icon="🚨")
 
 # Capture the hash generation difficulty target  (number of leading zeroes needed in the generated hash)
 pychain.difficulty = difficulty_section.number_input("ENTER / SELECT DIFFICULTY TARGET",
@@ -397,6 +311,27 @@ with lower_zone:
 
     st.dataframe( pychain_df, hide_index=False)
 
+# Show flow analytics over a time window of the ledger in a collapsible section of the lower zone
+with lower_zone.expander("**Ledger Analytics**"):
+    today = datetime.datetime.utcnow().date()
+    window_dates = st.date_input("SELECT TIME WINDOW", value=(today, today))   # A (start, end) tuple, which only has a start while the user is still choosing the end
+
+    if len(window_dates) == 2:
+        # Convert the dates to a window running from the start of the first day to the end of the last day
+        window_start = datetime.datetime.combine(window_dates[0], datetime.time.min)
+        window_end = datetime.datetime.combine(window_dates[1], datetime.time.max)
+
+        analytics_left, analytics_right = st.columns(2)
+        analytics_left.markdown("Volume per Sender / Receiver")
+        analytics_left.dataframe(pychain.ledger_index.pair_volume(window_start, window_end), hide_index=True)
+        analytics_right.markdown("Daily Totals")
+        analytics_right.dataframe(pychain.ledger_index.period_totals("D", window_start, window_end))
+
+        # Show the top counterparties of the selected user within the window
+        analytics_user = st.selectbox("SELECT USER FOR TOP COUNTERPARTIES", address_book_df["user_name"])
+        top_n = st.number_input("NUMBER OF COUNTERPARTIES", min_value=1, max_value=len(address_book_df), value=3, step=1)
+        st.dataframe(pychain.ledger_index.top_counterparties(analytics_user, int(top_n), window_start, window_end), hide_index=True)
+
 ###########################################################################################################
 # Sidebar     
 ###########################################################################################################
@@ -424,6 +359,7 @@ md_text += f"|Created:|{pychain.chain[selected_block].timestamp}|\r\n"
 md_text += f"|Creator Id:|{pychain.chain[selected_block].creator_id}|\r\n"
 md_text += f"|Previous Hash:|{pychain.chain[selected_block].prev_hash[0:32]}{chr(0x200B)}{pychain.chain[selected_block].prev_hash[32:]}|\r\n" # Split the hash as it is too long
 md_text += f"|Nonce:|{pychain.chain[selected_block].nonce:,}|\r\n"
+md_text += f"|Hash Algorithm:|{pychain.chain[selected_block].hash_algorithm}|\r\n"
 if selected_block == 0:
     md_text += f"|Record:|{pychain.chain[selected_block].record}|\r\n"
 else:
@@ -431,9 +367,23 @@ else:
     md_text += f"|Receiver:|{pychain.chain[selected_block].record.receiver}|\r\n"
     md_text += f"|Amount:|{pychain.chain[selected_block].record.amount:0,.2f}|\r\n"
 
+# Prove the selected block's inclusion at its height against the accumulator root, as a third party would
+inclusion_proof = pychain.prove_inclusion(selected_block)
+block_included = MerkleMountainRange.verify_inclusion(pychain.chain[selected_block].hash_block(), inclusion_proof, pychain.accumulator.root(), pychain.hash_algorithm)
+md_text += f"|Inclusion Proof:|{'Verified' if block_included else 'Failed'} ({len(inclusion_proof.path)} hashes)|\r\n"
+
 # Show the block's data in a table as markdown 
 st.sidebar.markdown(md_text)
 
+# Quick audit which only looks for a tampered and re-mined tail, so it rehashes O(log n) blocks rather than the whole chain
+st.sidebar.markdown("**Chain Audit**")
+if st.sidebar.button("Audit Re-mined Tail", help="Finds where a tampered and re-mined tail of the PyChain starts by rehashing only a few blocks. Use Validate Chain to check every block"):
+    tail_height = pychain.locate_tampering()
+    if tail_height is None:
+        st.toast(':green[Audit found no re-mined tail]', icon="✅")
+    else:
+        st.toast(f':red[Audit failed - re-mined tail starts at block: {tail_height}]', icon="🚨")
+
 ################################################################################
 # Step 4:
 # Test the PyChain Ledger by Storing Records
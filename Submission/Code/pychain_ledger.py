@@ -0,0 +1,502 @@
+# PyChain Ledger classes
+#
+# The hash backends, Record, Block, Merkle Mountain Range accumulator, ledger index and PyChain used by the
+# pychain_bi.py Streamlit application. Kept apart from the application so they can be imported without
+# building the user interface, eg by test_pychain_bi.py.
+
+################################################################################
+# Imports
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+import datetime as datetime
+import pandas as pd
+import numpy as np
+import hashlib
+import timeit
+from functools import partial
+
+
+################################################################################
+# Define constants
+allowed_hash_backends = ["sha256", "blake2b", "sha3_256"]  # Hash backends the startup benchmark may choose from for new chains
+default_hash_backend = "sha256"   # Hash backend used for new chains unless another allowed backend is clearly faster
+hash_backend_margin = 0.8         # Another backend must take no more than this fraction of the default's time to be chosen
+
+################################################################################
+# Hash backends
+
+# Constructors for the standard library hash algorithms a chain may use. All produce 32 byte (64 hex character) digests
+hash_backends = {
+    "sha256": hashlib.sha256,
+    "blake2b": partial(hashlib.blake2b, digest_size=32),
+    "sha3_256": hashlib.sha3_256,
+}
+
+def new_hasher(hash_algorithm):
+    """Returns a new hash object for the named hash algorithm."""
+    if hash_algorithm not in hash_backends:
+        raise ValueError(f"Unknown hash algorithm {hash_algorithm!r}, expected one of {list(hash_backends)}")
+    return hash_backends[hash_algorithm]()
+
+def benchmark_hash_backends(allowed=None, number=2000, repeat=5):
+    """Returns a dictionary of the best seconds per digest each allowed hash backend takes over repeat runs of a typical block's bytes."""
+    payload = str(Block(Record("Manny Riskin", "Aunt Emma", 1234.56), 12, prev_hash="0" * 64)).encode()  # Roughly the bytes hash_block digests
+
+    timings = {}
+    for hash_algorithm in (allowed or allowed_hash_backends):
+        runs = timeit.repeat("sha = new(); sha.update(payload); sha.hexdigest()",
+                             globals={"new": hash_backends[hash_algorithm], "payload": payload},
+                             number=number, repeat=repeat)
+        timings[hash_algorithm] = min(runs) / number  # The best run is the one least disturbed by the rest of the machine
+    return timings
+
+def select_hash_backend(allowed=None):
+    """Returns the name of the hash backend for new chains: the default, unless another allowed backend is faster by a clear margin on this CPU."""
+    timings = benchmark_hash_backends(allowed)
+    print("Hash backend timings: " + ", ".join(f"{name} {seconds * 1e9:0.0f}ns" for name, seconds in timings.items()))
+
+    fastest = min(timings, key=timings.get)
+    if default_hash_backend in timings and timings[fastest] > hash_backend_margin * timings[default_hash_backend]:
+        return default_hash_backend  # Differences within the margin are noise, so keep the chain's algorithm stable between startups
+    return fastest
+
+################################################################################
+# Step 1:
+# Create a Record Data Class
+
+# Create a Record Data Class that consists of the `sender`, `receiver`, and
+# `amount` attributes
+@dataclass
+class Record:
+    sender: str             
+    receiver: str
+    amount: float
+
+
+
+################################################################################
+# Step 2:
+# Modify the Existing Block Data Class to Store Record Data
+
+@dataclass
+class Block:
+    """Creates a Block Chain block object\n\n
+
+    Parameters arguments:\n
+    record -- the record of data to be stored in the block\n
+    creator_id -- the ID of the Creator\n
+    prev_hash -- the has of the previous block in the chain. Default: "0"\n
+    nonce -- the nonce for the block. Default: 0\n
+    hash_algorithm -- the name of the hash backend used to hash the block. Default: "sha256"
+    """
+    record: Record
+    creator_id: int
+    prev_hash: str = "0"
+    timestamp: str = field(default_factory=lambda: datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"))  # Use the full ISO 8601 date and time format YYYY-MM-DDTHH:MM:SS.ssssssZ, taken when the block is created
+    nonce: int = 0
+    hash_algorithm: str = "sha256"
+
+    def hash_block(self):
+        """Returns the hash digest in hexadecimal of the class attributes, using the block's hash algorithm."""
+        sha = new_hasher(self.hash_algorithm)
+
+        record = str(self.record).encode()
+        sha.update(record)
+
+        creator_id = str(self.creator_id).encode()
+        sha.update(creator_id)
+
+        timestamp = str(self.timestamp).encode()
+        sha.update(timestamp)
+
+        prev_hash = str(self.prev_hash).encode()
+        sha.update(prev_hash)
+
+        nonce = str(self.nonce).encode()
+        sha.update(nonce)
+
+        hash_algorithm = str(self.hash_algorithm).encode()
+        sha.update(hash_algorithm)
+
+        return sha.hexdigest()
+
+
+################################################################################
+# Merkle Mountain Range (MMR) accumulator over the block hashes
+
+@dataclass
+class InclusionProof:
+    """Proof that a block hash is included in the PyChain at a given height\n\n
+
+    Parameters arguments:\n
+    height -- the index of the block in the chain\n
+    leaf_count -- the number of blocks in the accumulator when the proof was made\n
+    path -- list of (side, digest) siblings from the leaf up to its peak, side is "L" or "R"\n
+    peaks -- the digests of all the mountain peaks, left to right\n
+    peak_index -- the position in peaks of the peak the path leads to\n
+    hash_algorithm -- the name of the hash backend used by the accumulator
+    """
+    height: int
+    leaf_count: int
+    path: List[Tuple[str, str]]
+    peaks: List[str]
+    peak_index: int
+    hash_algorithm: str = "sha256"
+
+
+@dataclass
+class MerkleMountainRange:
+    """Append-only accumulator of block hashes\n\n
+
+    Each block hash is a leaf. Whenever two mountains of the same size sit side by side they are merged
+    under a parent node, so appending is O(log n) and the accumulator is summarised by the root, the
+    hash of the leaf count and its peaks. levels[0] holds the leaf digests, levels[h] holds the nodes
+    covering 2^h leaves. Leaves, nodes and the root are hashed with distinct prefixes so one can not be
+    passed off as another.
+    """
+    block_hashes: List[str] = field(default_factory=list)
+    levels: List[List[str]] = field(default_factory=lambda: [[]])
+    hash_algorithm: str = "sha256"
+
+    @staticmethod
+    def hash_leaf(block_hash, hash_algorithm):
+        """Returns the digest of the leaf holding a block hash."""
+        sha = new_hasher(hash_algorithm)
+        sha.update(b"\x00" + block_hash.encode())
+        return sha.hexdigest()
+
+    @staticmethod
+    def hash_node(left, right, hash_algorithm):
+        """Returns the digest of a parent node from the digests of its two children."""
+        sha = new_hasher(hash_algorithm)
+        sha.update(b"\x01" + left.encode() + right.encode())
+        return sha.hexdigest()
+
+    @staticmethod
+    def bag_peaks(peaks, leaf_count, hash_algorithm):
+        """Returns the root digest of the accumulator from its leaf count and the digests of its peaks."""
+        sha = new_hasher(hash_algorithm)
+        sha.update(b"\x02" + str(leaf_count).encode() + b":" + "".join(peaks).encode())
+        return sha.hexdigest()
+
+    @staticmethod
+    def peak_layout(leaf_count):
+        """Returns the (level, first leaf height) of each peak for the given leaf count, left to right.
+        A peak exists at level h when bit h of the leaf count is set."""
+        layout = []
+        first_leaf = 0
+        for level in reversed(range(leaf_count.bit_length())):
+            if (leaf_count >> level) & 1:
+                layout.append((level, first_leaf))
+                first_leaf += 1 << level
+        return layout
+
+    def __len__(self):
+        return len(self.block_hashes)
+
+    def leaf(self, height):
+        """Returns the block hash recorded at the given height."""
+        return self.block_hashes[height]
+
+    def append(self, block_hash):
+        """Adds a block hash as the next leaf, merging equal sized mountains as it goes."""
+        self.block_hashes.append(block_hash)
+        self.levels[0].append(self.hash_leaf(block_hash, self.hash_algorithm))
+
+        level = 0
+        while len(self.levels[level]) % 2 == 0:  # An even count at a level means the last two nodes have just been paired
+            if len(self.levels) == level + 1:
+                self.levels.append([])
+            nodes = self.levels[level]
+            self.levels[level + 1].append(self.hash_node(nodes[-2], nodes[-1], self.hash_algorithm))
+            level += 1
+
+    def peaks(self):
+        """Returns the (level, index) of each peak, left to right."""
+        return [(level, first_leaf >> level) for level, first_leaf in self.peak_layout(len(self))]
+
+    def root(self):
+        """Returns the digest summarising every block hash in the accumulator."""
+        return self.bag_peaks([self.levels[level][index] for level, index in self.peaks()], len(self), self.hash_algorithm)
+
+    def prove(self, height):
+        """Returns an InclusionProof for the block hash at the given height."""
+        if not 0 <= height < len(self):
+            raise IndexError(f"No block at height {height}")
+
+        path = []
+        level, index = 0, height
+        while index ^ 1 < len(self.levels[level]):  # Climb until the node has no sibling, ie it is a peak
+            sibling = index ^ 1
+            path.append(("L" if sibling < index else "R", self.levels[level][sibling]))
+            level, index = level + 1, index >> 1
+
+        peaks = self.peaks()
+        return InclusionProof(height=height,
+                              leaf_count=len(self),
+                              path=path,
+                              peaks=[self.levels[lvl][idx] for lvl, idx in peaks],
+                              peak_index=peaks.index((level, index)),
+                              hash_algorithm=self.hash_algorithm)
+
+    @classmethod
+    def verify_inclusion(cls, block_hash, proof, root, hash_algorithm):
+        """Returns True if the proof shows block_hash is included at proof.height under the given root.
+        hash_algorithm is the one recorded in the chain's Genesis block, not the one claimed by the proof."""
+        if proof.hash_algorithm != hash_algorithm or not 0 <= proof.height < proof.leaf_count:
+            return False
+
+        # The height and leaf count alone fix which peak covers the block and how far below it the leaf sits
+        layout = cls.peak_layout(proof.leaf_count)
+        peak_index = max(i for i, (level, first_leaf) in enumerate(layout) if first_leaf <= proof.height)
+        peak_level = layout[peak_index][0]
+        if proof.peak_index != peak_index or len(proof.path) != peak_level or len(proof.peaks) != len(layout):
+            return False
+
+        digest = cls.hash_leaf(block_hash, hash_algorithm)
+        for level, (side, sibling) in enumerate(proof.path):
+            if side != ("L" if (proof.height >> level) & 1 else "R"):  # The sides taken must spell out the claimed height
+                return False
+            if side == "L":
+                digest = cls.hash_node(sibling, digest, hash_algorithm)
+            else:
+                digest = cls.hash_node(digest, sibling, hash_algorithm)
+
+        if proof.peaks[peak_index] != digest:
+            return False
+
+        return cls.bag_peaks(proof.peaks, proof.leaf_count, hash_algorithm) == root
+
+
+################################################################################
+# Time-range query engine over the ledger records
+
+def parse_timestamp(timestamp):
+    """Returns a UTC numpy datetime64 (microseconds) from an ISO 8601 string or a datetime.
+    A time zone, including the "Z" suffix, is converted to UTC; a timestamp without one is taken to be UTC already."""
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if isinstance(timestamp, datetime.datetime) and timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)  # numpy datetime64 has no time zones
+    return np.datetime64(timestamp, "us")
+
+
+@dataclass
+class LedgerIndex:
+    """Sorted timestamp index of the PyChain's records with vectorised flow analytics\n\n
+
+    The records are held in numpy column arrays ordered by timestamp which grow by doubling, so indexing a
+    block is amortised O(1) when blocks arrive in time order. A time window is located with a binary search
+    and sliced as a view, so a query costs time in proportion to the records in the window rather than the
+    length of the chain. Query results are cached until the next block is indexed.
+    """
+    timestamps: np.ndarray = field(default_factory=lambda: np.empty(16, dtype="datetime64[us]"))
+    senders: np.ndarray = field(default_factory=lambda: np.empty(16, dtype=object))
+    receivers: np.ndarray = field(default_factory=lambda: np.empty(16, dtype=object))
+    amounts: np.ndarray = field(default_factory=lambda: np.empty(16, dtype=np.float64))
+    heights: np.ndarray = field(default_factory=lambda: np.empty(16, dtype=np.int64))
+    size: int = 0
+    cache: dict = field(default_factory=dict)
+
+    def columns(self):
+        """Returns the names of the column arrays, in the order they are stored."""
+        return ["timestamps", "senders", "receivers", "amounts", "heights"]
+
+    def add(self, height, block):
+        """Indexes the record of the block at the given height. Blocks without a Record (ie the Genesis block) are skipped."""
+        if not isinstance(block.record, Record):
+            return
+
+        if self.size == len(self.timestamps):  # Double the capacity of every column when full
+            for name in self.columns():
+                column = getattr(self, name)
+                grown = np.empty(len(column) * 2, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                setattr(self, name, grown)
+
+        timestamp = parse_timestamp(block.timestamp)
+        position = int(np.searchsorted(self.timestamps[:self.size], timestamp, side="right"))  # Normally the end, as blocks arrive in time order
+
+        values = [timestamp, block.record.sender, block.record.receiver, block.record.amount, height]
+        for name, value in zip(self.columns(), values):
+            column = getattr(self, name)
+            column[position + 1:self.size + 1] = column[position:self.size]  # Only moves data for a block stamped earlier than its predecessors
+            column[position] = value
+        self.size += 1
+
+        self.cache.clear()  # Results are only valid until the ledger changes
+
+    def window(self, start=None, end=None):
+        """Returns a DataFrame of the records with start <= timestamp <= end. Either bound may be None for an open window."""
+        timestamps = self.timestamps[:self.size]
+        low = 0 if start is None else int(np.searchsorted(timestamps, parse_timestamp(start), side="left"))
+        high = self.size if end is None else int(np.searchsorted(timestamps, parse_timestamp(end), side="right"))
+        high = max(low, high)
+
+        return pd.DataFrame({"timestamp": self.timestamps[low:high],
+                             "sender": self.senders[low:high],
+                             "receiver": self.receivers[low:high],
+                             "amount": self.amounts[low:high],
+                             "height": self.heights[low:high]})
+
+    def cached(self, key, compute):
+        """Returns a copy of the cached result for key, computing and caching it on the first request since the last append.
+        A copy is returned so a caller changing the result can not change what later queries return."""
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key].copy()
+
+    def pair_volume(self, start=None, end=None):
+        """Returns the total amount and number of transfers for each sender / receiver pair in the window, largest first."""
+        def compute():
+            records = self.window(start, end)
+            volume = records.groupby(["sender", "receiver"])["amount"].agg(amount="sum", transfers="count")
+            return volume.sort_values("amount", ascending=False).reset_index()
+
+        return self.cached(("pair_volume", start, end), compute)
+
+    def period_totals(self, freq="D", start=None, end=None):
+        """Returns the total amount and number of transfers per period in the window, freq being a pandas offset alias such as "h", "D" or "W"."""
+        def compute():
+            records = self.window(start, end)
+            return records.set_index("timestamp")["amount"].resample(freq).agg(["sum", "count"]).rename(
+                columns={"sum": "amount", "count": "transfers"})
+
+        return self.cached(("period_totals", freq, start, end), compute)
+
+    def top_counterparties(self, user, n=5, start=None, end=None):
+        """Returns the n counterparties the user has moved the most value with (sent plus received) in the window.
+        Transfers from the user to themselves have no counterparty and are left out."""
+        def compute():
+            records = self.window(start, end)
+            sent = (records["sender"] == user).to_numpy()
+            received = (records["receiver"] == user).to_numpy()
+            involved = sent ^ received  # Exactly one side is the user, which excludes self-transfers
+            counterparty = np.where(sent, records["receiver"], records["sender"])[involved]
+
+            flows = pd.DataFrame({"counterparty": counterparty,
+                                  "sent": np.where(sent, records["amount"], 0.0)[involved],
+                                  "received": np.where(received, records["amount"], 0.0)[involved]})
+            totals = flows.groupby("counterparty")[["sent", "received"]].sum()
+            totals["volume"] = totals["sent"] + totals["received"]
+            return totals.nlargest(n, "volume").reset_index()
+
+        return self.cached(("top_counterparties", user, n, start, end), compute)
+
+
+# PyChain Class
+@dataclass
+class PyChain:
+    chain: List[Block]
+    difficulty: int = 4
+    accumulator: MerkleMountainRange = field(default_factory=MerkleMountainRange)
+    ledger_index: LedgerIndex = field(default_factory=LedgerIndex)
+    tampered_height: Optional[int] = None  # The first tampered block found by the last call to is_valid, None if it passed
+
+    # Record the hashes of any blocks the PyChain was created with (ie the Genesis block) in the accumulator and the ledger index
+    def __post_init__(self):
+        if len(self.accumulator) == 0 and self.chain:
+            self.accumulator.hash_algorithm = self.hash_algorithm  # The accumulator hashes with the same backend as the chain
+
+        for height, block in enumerate(self.chain[len(self.accumulator):], start=len(self.accumulator)):
+            self.accumulator.append(block.hash_block())
+            self.ledger_index.add(height, block)
+
+    # PyChain Hash Algorithm property - the hash backend recorded in the Genesis block, which every block in the chain must use.
+    # An empty PyChain has no Genesis block yet, so it reports the accumulator's backend
+    @property
+    def hash_algorithm(self):
+        return self.chain[0].hash_algorithm if self.chain else self.accumulator.hash_algorithm
+
+    # PyChain Proof Of Work method - returns a block with a hash meeting the difficulty target
+    def proof_of_work(self, block):
+        calculated_hash = block.hash_block()
+
+        num_of_zeros = "0" * self.difficulty
+
+        while not calculated_hash.startswith(num_of_zeros):
+
+            block.nonce += 1
+
+            calculated_hash = block.hash_block()
+
+        return block
+
+    # PyChain Add Block method - calls proof of work and then adds a block to the PyChain
+    def add_block(self, candidate_block):
+        if self.chain:
+            candidate_block.hash_algorithm = self.hash_algorithm  # Mine with the chain's hash backend
+        else:
+            self.accumulator.hash_algorithm = candidate_block.hash_algorithm  # The first block added is the Genesis block and sets the backend
+        block = self.proof_of_work(candidate_block)
+        self.chain += [block]
+        self.accumulator.append(block.hash_block())  # Record the mined hash so later tampering can be located and inclusion proven
+        self.ledger_index.add(len(self.chain) - 1, block)  # Index the record for time-range queries, which also clears the query cache
+
+    # PyChain Is Valid method - runs through each block in the PyChain checking its link, hash algorithm and the hash recorded when it was mined.
+    # Returns false at the first invalid block, recording its height in tampered_height, or true if all are valid
+    def is_valid(self):
+        self.tampered_height = None
+        block_hash = None
+
+        for height, block in enumerate(self.chain):
+            # Check the hash algorithm against the one recorded when the chain was created before hashing, as a tampered name may not be a known backend
+            if block.hash_algorithm != self.accumulator.hash_algorithm:
+                self.tampered_height = height
+                break
+
+            linked = height == 0 or block.prev_hash == block_hash
+            block_hash = block.hash_block()
+
+            # A rewritten and re-mined tail keeps its links intact, so each block is also checked against the hash recorded when it was mined
+            if not linked or height >= len(self.accumulator) or block_hash != self.accumulator.leaf(height):
+                self.tampered_height = height
+                break
+        else:
+            if len(self.chain) < len(self.accumulator):  # Blocks removed from the end of the chain
+                self.tampered_height = len(self.chain)
+
+        if self.tampered_height is not None:
+            print(f"Blockchain is invalid! First tampered block: {self.tampered_height}")
+            return False
+
+        print("Blockchain is Valid")
+        return True
+
+    # PyChain Block Matches Accumulator method - rehashes a single block and compares it with the hash recorded when it was mined.
+    # A block whose hash algorithm has been changed does not match, and is not hashed as the name may not be a known backend
+    def block_matches_accumulator(self, height):
+        block = self.chain[height]
+        return block.hash_algorithm == self.accumulator.hash_algorithm and block.hash_block() == self.accumulator.leaf(height)
+
+    # PyChain Locate Tampering method - finds where a tampered and re-mined tail of the PyChain starts with O(log n) rehashing
+    def locate_tampering(self) -> Optional[int]:
+        """Returns the height where a tampered, re-mined tail of the chain starts, or None if the last block is intact.\n\n
+
+        Threat model: to keep the prev_hash links lined up, an attacker who edits a block must re-mine every block
+        after it. That changes the hash of every block from the edited one to the end of the chain, while the blocks
+        below keep the hashes recorded in the accumulator. The mismatches therefore form one run at the end of the
+        chain and a binary search finds where it starts with O(log n) rehashes.
+
+        Tampering outside this model is not located. A block edited without re-mining the blocks after it leaves the
+        last block intact, so None is returned, and such an edit below a re-mined tail is hidden by the tail. Both
+        break a prev_hash link or a recorded hash, so is_valid, which checks every block, still reports them.
+        """
+        if len(self.chain) != len(self.accumulator):
+            return min(len(self.chain), len(self.accumulator))  # Blocks removed or added without being mined through add_block
+
+        if not self.chain or self.block_matches_accumulator(len(self.chain) - 1):
+            return None
+
+        low, high = 0, len(self.chain) - 1  # Invariant: the re-mined tail starts in [low, high] and high is a mismatch
+        while low < high:
+            mid = (low + high) // 2
+            if self.block_matches_accumulator(mid):
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    # PyChain Prove Inclusion method - returns a proof, verifiable by a third party against the accumulator root, that a block is at the given height
+    def prove_inclusion(self, height):
+        return self.accumulator.prove(height)
@@ -0,0 +1,322 @@
+# Tests for the PyChain ledger classes in pychain_ledger.py, which the pychain_bi.py Streamlit application uses.
+#
+# Run with: pytest test_pychain_bi.py
+
+import datetime
+import warnings
+
+import numpy as np
+import pytest
+
+import pychain_ledger
+from pychain_ledger import Block, Record, PyChain, MerkleMountainRange, LedgerIndex, parse_timestamp
+
+
+def make_chain(num_blocks, hash_algorithm="sha256"):
+    """Returns a PyChain of a Genesis block followed by num_blocks mined blocks."""
+    pychain = PyChain([Block("Genesis", 0, hash_algorithm=hash_algorithm)], difficulty=1)
+    for i in range(num_blocks):
+        pychain.add_block(Block(Record("Manny Riskin", "Aunt Emma", float(i)), 12, prev_hash=pychain.chain[-1].hash_block()))
+    return pychain
+
+
+def remine_from(pychain, height):
+    """Re-mines every block from height on so the prev_hash links line up again, as an attacker would."""
+    for h in range(height, len(pychain.chain)):
+        if h > height:
+            pychain.chain[h].prev_hash = pychain.chain[h - 1].hash_block()
+        pychain.proof_of_work(pychain.chain[h])
+
+
+################################################################################
+# Merkle Mountain Range inclusion proofs
+
+@pytest.mark.parametrize("leaf_count", [1, 2, 3, 4, 7, 8, 13])
+def test_inclusion_proofs_verify_at_every_height(leaf_count):
+    mmr = MerkleMountainRange()
+    for i in range(leaf_count):
+        mmr.append(f"{i:064x}")
+
+    for height in range(leaf_count):
+        assert MerkleMountainRange.verify_inclusion(mmr.leaf(height), mmr.prove(height), mmr.root(), "sha256")
+
+
+@pytest.mark.parametrize("leaf_count", [3, 5, 7, 13])
+def test_proof_rejected_at_another_height(leaf_count):
+    mmr = MerkleMountainRange()
+    for i in range(leaf_count):
+        mmr.append(f"{i:064x}")
+
+    for height in range(leaf_count):
+        for claimed in range(leaf_count):
+            if claimed != height:
+                proof = mmr.prove(height)
+                proof.height = claimed
+                assert not MerkleMountainRange.verify_inclusion(mmr.leaf(height), proof, mmr.root(), "sha256")
+
+
+def test_internal_node_rejected_as_block_hash():
+    mmr = MerkleMountainRange()
+    for i in range(4):
+        mmr.append(f"{i:064x}")
+
+    proof = mmr.prove(1)
+    proof.path = proof.path[1:]  # Present the node above leaves 2 and 3 as if it were a block at height 1
+    assert not MerkleMountainRange.verify_inclusion(mmr.levels[1][1], proof, mmr.root(), "sha256")
+
+
+def test_proof_rejected_with_another_leaf_count():
+    mmr = MerkleMountainRange()
+    for i in range(6):
+        mmr.append(f"{i:064x}")
+
+    proof = mmr.prove(4)
+    proof.leaf_count = 5
+    assert not MerkleMountainRange.verify_inclusion(mmr.leaf(4), proof, mmr.root(), "sha256")
+
+
+def test_proof_rejected_with_another_hash_algorithm():
+    pychain = make_chain(5, hash_algorithm="blake2b")
+    proof = pychain.prove_inclusion(3)
+    block_hash = pychain.chain[3].hash_block()
+    assert MerkleMountainRange.verify_inclusion(block_hash, proof, pychain.accumulator.root(), "blake2b")
+    assert not MerkleMountainRange.verify_inclusion(block_hash, proof, pychain.accumulator.root(), "sha256")
+
+
+################################################################################
+# Hash backends
+
+@pytest.mark.parametrize("hash_algorithm", ["sha256", "blake2b", "sha3_256"])
+def test_chain_uses_genesis_hash_algorithm(hash_algorithm):
+    pychain = make_chain(5, hash_algorithm=hash_algorithm)
+    assert pychain.accumulator.hash_algorithm == hash_algorithm
+    assert all(block.hash_algorithm == hash_algorithm for block in pychain.chain)
+    assert pychain.is_valid()
+
+
+@pytest.mark.parametrize("height", [0, 3, 5])
+@pytest.mark.parametrize("hash_algorithm", ["md5", "blake2b"])
+def test_tampered_hash_algorithm_is_located(height, hash_algorithm):
+    pychain = make_chain(5)
+    pychain.chain[height].hash_algorithm = hash_algorithm
+
+    assert not pychain.is_valid()
+    assert pychain.tampered_height == height
+    assert not pychain.block_matches_accumulator(height)
+
+
+def test_tampered_hash_algorithm_in_remined_tail_is_located():
+    pychain = make_chain(10)
+    pychain.chain[9].hash_algorithm = "md5"
+    pychain.chain[10].hash_algorithm = "md5"
+    assert pychain.locate_tampering() == 9
+
+
+@pytest.mark.parametrize("timings, expected", [
+    ({"sha256": 100e-9, "blake2b": 95e-9, "sha3_256": 110e-9}, "sha256"),    # Within the margin, keep the default
+    ({"sha256": 100e-9, "blake2b": 60e-9, "sha3_256": 110e-9}, "blake2b"),   # Clearly faster
+    ({"blake2b": 95e-9, "sha3_256": 100e-9}, "blake2b"),                     # Default not allowed
+])
+def test_select_hash_backend(monkeypatch, timings, expected):
+    monkeypatch.setattr(pychain_ledger, "benchmark_hash_backends", lambda allowed=None: timings)
+    assert pychain_ledger.select_hash_backend() == expected
+
+
+################################################################################
+# Tamper localisation
+
+def test_untampered_chain_is_valid():
+    pychain = make_chain(10)
+    assert pychain.is_valid()
+    assert pychain.tampered_height is None
+    assert pychain.locate_tampering() is None
+
+
+def test_isolated_edit_is_located_by_is_valid_only():
+    pychain = make_chain(10)
+    pychain.chain[4].record.amount = 1000.0
+
+    assert not pychain.is_valid()
+    assert pychain.tampered_height == 4
+    assert pychain.locate_tampering() is None  # Outside the re-mined tail threat model, the last block is intact
+
+
+def test_remined_tail_is_located():
+    pychain = make_chain(10)
+    pychain.chain[7].record.amount = 1000.0
+    remine_from(pychain, 7)
+
+    assert not pychain.is_valid()
+    assert pychain.tampered_height == 7
+    assert pychain.locate_tampering() == 7
+
+
+@pytest.mark.parametrize("tail_height", [0, 1, 5, 10])
+def test_remined_tail_is_located_at_any_height(tail_height):
+    pychain = make_chain(10)
+    pychain.chain[tail_height].creator_id = 99
+    remine_from(pychain, tail_height)
+
+    assert pychain.locate_tampering() == tail_height
+
+
+def test_isolated_edit_below_remined_tail_is_located_by_is_valid():
+    pychain = make_chain(10)
+    pychain.chain[3].record.amount = 1000.0
+    pychain.chain[7].record.amount = 1000.0
+    remine_from(pychain, 7)
+
+    assert not pychain.is_valid()
+    assert pychain.tampered_height == 3
+    assert pychain.locate_tampering() == 7  # The audit only finds where the re-mined tail starts
+
+
+@pytest.mark.parametrize("tail_height", [None, 990])
+def test_locate_tampering_rehashes_logarithmically(monkeypatch, tail_height):
+    pychain = make_chain(1000)
+    if tail_height is not None:
+        pychain.chain[tail_height].record.amount = 1000.0
+        remine_from(pychain, tail_height)
+
+    rehashes = []
+    hash_block = Block.hash_block
+    monkeypatch.setattr(Block, "hash_block", lambda block: rehashes.append(block) or hash_block(block))
+
+    assert pychain.locate_tampering() == tail_height
+    assert len(rehashes) <= 12  # One for the last block plus a binary search over 1,001 blocks
+
+
+def test_empty_chain():
+    pychain = PyChain([], difficulty=1)
+    assert pychain.is_valid()
+    assert pychain.locate_tampering() is None
+
+    pychain.add_block(Block("Genesis", 0, hash_algorithm="blake2b"))
+    pychain.add_block(Block(Record("Manny Riskin", "Aunt Emma", 1.0), 12, prev_hash=pychain.chain[-1].hash_block()))
+    assert pychain.hash_algorithm == pychain.accumulator.hash_algorithm == "blake2b"
+    assert pychain.chain[1].hash_algorithm == "blake2b"
+    assert pychain.is_valid()
+
+
+def test_removed_block_is_located():
+    pychain = make_chain(10)
+    pychain.chain.pop()
+
+    assert not pychain.is_valid()
+    assert pychain.tampered_height == 10
+    assert pychain.locate_tampering() == 10
+
+
+################################################################################
+# Ledger index and flow analytics
+
+def make_index(transfers):
+    """Returns a LedgerIndex of (timestamp, sender, receiver, amount) transfers, indexed at heights 1, 2, ..."""
+    index = LedgerIndex()
+    for height, (timestamp, sender, receiver, amount) in enumerate(transfers, start=1):
+        index.add(height, Block(Record(sender, receiver, amount), 12, timestamp=timestamp))
+    return index
+
+
+day_transfers = [
+    ("2024-01-01T00:00:00.000000Z", "A", "B", 1.0),
+    ("2024-01-01T12:00:00.000000Z", "A", "B", 2.0),
+    ("2024-01-02T00:00:00.000000Z", "B", "C", 4.0),
+    ("2024-01-02T12:00:00.000000Z", "C", "A", 8.0),
+    ("2024-01-03T00:00:00.000000Z", "A", "C", 16.0),
+]
+
+
+def test_parse_timestamp_converts_to_utc():
+    expected = np.datetime64("2024-01-01T10:00:00", "us")
+    assert parse_timestamp("2024-01-01T10:00:00.000000Z") == expected
+    assert parse_timestamp("2024-01-01T12:00:00+02:00") == expected
+    assert parse_timestamp("2024-01-01T10:00:00") == expected
+    assert parse_timestamp(datetime.datetime(2024, 1, 1, 10)) == expected
+
+    aware = datetime.datetime(2024, 1, 1, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=-5)))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # numpy warns and drops the offset if handed an aware datetime
+        assert parse_timestamp(aware) == expected
+
+
+@pytest.mark.parametrize("start, end, expected_heights", [
+    ("2024-01-01T12:00:00Z", "2024-01-02T12:00:00Z", [2, 3, 4]),                         # Both bounds are inclusive
+    ("2024-01-01T12:00:00.000001Z", "2024-01-02T11:59:59.999999Z", [3]),
+    (None, "2024-01-01T12:00:00Z", [1, 2]),                                               # Open start
+    ("2024-01-02T12:00:00Z", None, [4, 5]),                                               # Open end
+    (None, None, [1, 2, 3, 4, 5]),
+    (datetime.datetime(2024, 1, 2), datetime.datetime(2024, 1, 2, 12), [3, 4]),           # datetime bounds
+    ("2024-01-02T00:00:00", "2024-01-02T12:00:00", [3, 4]),                               # No "Z" suffix
+    ("2024-01-04T00:00:00Z", "2024-01-05T00:00:00Z", []),                                 # After every record
+    ("2024-01-03T00:00:00Z", "2024-01-01T00:00:00Z", []),                                 # End before start
+])
+def test_window_bounds(start, end, expected_heights):
+    index = make_index(day_transfers)
+    assert list(index.window(start, end)["height"]) == expected_heights
+
+
+def test_add_keeps_records_sorted_when_out_of_order():
+    index = make_index(day_transfers + [("2024-01-01T06:00:00.000000Z", "B", "A", 32.0)])
+    window = index.window()
+    assert list(window["height"]) == [1, 6, 2, 3, 4, 5]
+    assert list(window["amount"]) == [1.0, 32.0, 2.0, 4.0, 8.0, 16.0]
+    assert window["timestamp"].is_monotonic_increasing
+
+
+def test_add_grows_past_initial_capacity():
+    start = datetime.datetime(2024, 1, 1)
+    transfers = [((start + datetime.timedelta(minutes=i)).isoformat() + "Z", "A", "B", float(i)) for i in range(40)]
+    index = make_index(transfers)
+
+    assert index.size == 40
+    assert len(index.timestamps) >= 40
+    assert list(index.window()["amount"]) == [float(i) for i in range(40)]
+
+
+def test_genesis_block_is_not_indexed():
+    pychain = PyChain([Block("Genesis", 0)], difficulty=1)
+    assert pychain.ledger_index.size == 0
+
+
+def test_pair_volume():
+    volume = make_index(day_transfers).pair_volume("2024-01-01T00:00:00Z", "2024-01-02T12:00:00Z")
+    assert volume.to_dict("records") == [
+        {"sender": "C", "receiver": "A", "amount": 8.0, "transfers": 1},
+        {"sender": "B", "receiver": "C", "amount": 4.0, "transfers": 1},
+        {"sender": "A", "receiver": "B", "amount": 3.0, "transfers": 2},
+    ]
+
+
+def test_period_totals():
+    totals = make_index(day_transfers).period_totals("D", "2024-01-01T00:00:00Z", "2024-01-02T23:59:59Z")
+    assert list(totals.index) == [np.datetime64("2024-01-01"), np.datetime64("2024-01-02")]
+    assert list(totals["amount"]) == [3.0, 12.0]
+    assert list(totals["transfers"]) == [2, 2]
+
+
+def test_top_counterparties():
+    top = make_index(day_transfers).top_counterparties("A", n=1)
+    assert top.to_dict("records") == [{"counterparty": "C", "sent": 16.0, "received": 8.0, "volume": 24.0}]
+
+
+def test_top_counterparties_leaves_out_self_transfers():
+    index = make_index([("2024-01-01T00:00:00Z", "A", "A", 10.0), ("2024-01-01T01:00:00Z", "A", "B", 1.0)])
+    top = index.top_counterparties("A")
+    assert top.to_dict("records") == [{"counterparty": "B", "sent": 1.0, "received": 0.0, "volume": 1.0}]
+
+
+def test_cached_results_can_not_be_changed_by_callers():
+    index = make_index(day_transfers)
+    result = index.pair_volume()
+    result["amount"] = -1.0
+    assert (index.pair_volume()["amount"] > 0).all()
+
+
+def test_cache_cleared_by_add_block():
+    pychain = make_chain(3)
+    assert pychain.ledger_index.pair_volume()["amount"].sum() == 3.0
+    assert len(pychain.ledger_index.cache) == 1
+
+    pychain.add_block(Block(Record("Manny Riskin", "Aunt Emma", 10.0), 12, prev_hash=pychain.chain[-1].hash_block()))
+    assert pychain.ledger_index.pair_volume()["amount"].sum() == 13.0